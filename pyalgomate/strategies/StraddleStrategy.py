@@ -1,7 +1,9 @@
+import bisect
 import logging
 import datetime
-import traceback
-from typing import Set, ForwardRef
+import math
+import types
+from typing import Dict, Set, ForwardRef
 
 import pyalgotrade.bar
 from pyalgotrade.bar import BasicBar, Bars
@@ -14,12 +16,30 @@ from pyalgomate.core import resampled
 from pyalgomate.cli import CliMain
 import pyalgomate.utils as utils
 
+INFO_INTERVAL = datetime.timedelta(minutes=15)
+TICK_SIZE = 0.05
+TICK_INV = int(round(1.0 / TICK_SIZE))
+
 
 def getRoundedDateTime(originalDateTime: datetime.datetime, interval: datetime.timedelta):
-    timeIntervalMinutes = int(interval.total_seconds() / 60)
-    elapsedMinutes = originalDateTime.minute % timeIntervalMinutes
-    return originalDateTime - datetime.timedelta(minutes=elapsedMinutes, seconds=originalDateTime.second,
-                                                 microseconds=originalDateTime.microsecond)
+    timeIntervalMinutes = int(interval.total_seconds() // 60)
+    roundedMinute = originalDateTime.minute - (originalDateTime.minute % timeIntervalMinutes)
+    return originalDateTime.replace(minute=roundedMinute, second=0, microsecond=0)
+
+
+def roundToTick(price: float):
+    return math.floor(price * TICK_INV) / TICK_INV
+
+
+def computeStopLossAndBuffer(entryPrice: float, stopLossPercentage: float, bufferMultiplier: float):
+    stopLoss = roundToTick(entryPrice * (1 + stopLossPercentage / 100.0))
+    stopLossBuffer = roundToTick(stopLoss * bufferMultiplier)
+    return stopLoss, stopLossBuffer
+
+
+def getStopLossTable(stopLosses):
+    times = tuple(sorted(stopLosses))
+    return times, tuple(stopLosses[time] for time in times)
 
 
 class StraddlePosition:
@@ -32,6 +52,39 @@ class StraddlePosition:
 
 
 class StraddleStrategy(BaseOptionsGreeksStrategy):
+    _STRATEGY_NAME = 'StraddleStrategy'
+    _STOP_LOSSES = types.MappingProxyType({
+        datetime.time(hour=9, minute=15): 40,
+        datetime.time(hour=9, minute=30): 40,
+        datetime.time(hour=9, minute=45): 40,
+        datetime.time(hour=10, minute=0): 40,
+        datetime.time(hour=10, minute=15): 40,
+        datetime.time(hour=10, minute=30): 45,
+        datetime.time(hour=10, minute=45): 50,
+        datetime.time(hour=11, minute=0): 50,
+        datetime.time(hour=11, minute=15): 50,
+        datetime.time(hour=11, minute=30): 50,
+        datetime.time(hour=11, minute=45): 50,
+        datetime.time(hour=12, minute=0): 50,
+        datetime.time(hour=12, minute=15): 50,
+        datetime.time(hour=12, minute=30): 50,
+        datetime.time(hour=12, minute=45): 50,
+        datetime.time(hour=13, minute=0): 60,
+        datetime.time(hour=13, minute=15): 70,
+        datetime.time(hour=13, minute=30): 80,
+        datetime.time(hour=13, minute=45): 90,
+        datetime.time(hour=14, minute=0): 100,
+        datetime.time(hour=14, minute=15): 100,
+        datetime.time(hour=14, minute=30): 100,
+        datetime.time(hour=14, minute=45): 100
+    })
+    _slTimes, _slValues = getStopLossTable(_STOP_LOSSES)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_STOP_LOSSES' in cls.__dict__:
+            cls._slTimes, cls._slValues = getStopLossTable(cls._STOP_LOSSES)
+
     def __init__(self, feed, broker,
                  underlying,
                  lots=1,
@@ -41,13 +94,14 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
                  telegramChannelId=None,
                  telegramMessageThreadId=None):
         super(StraddleStrategy, self).__init__(feed, broker,
-                                               strategyName=strategyName if strategyName else __class__.__name__,
+                                               strategyName=strategyName or self._STRATEGY_NAME,
                                                logger=logging.getLogger(__name__),
                                                callback=callback,
                                                telegramBot=telegramBot,
                                                telegramChannelId=telegramChannelId,
                                                telegramMessageThreadId=telegramMessageThreadId
                                                )
+        self._feed = self.getFeed()
         self.exitTime = datetime.time(hour=15, minute=24)
         self.underlying = underlying
         self.rollingStraddleSymbol = f'{self.underlying} RS'
@@ -61,39 +115,20 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
         self.quantity = self.lotSize * self.lots
         self.stopLimitBufferPercentage = 15
         self.marketProtectionPercentage = 15
-        self.tickSize = 0.05
+        self._mpUp = 1 + self.marketProtectionPercentage / 100.0
+        self._mpDown = 1 - self.marketProtectionPercentage / 100.0
+        self._slBufMul = 1 + self.stopLimitBufferPercentage / 100.0
 
         self.maxEntries = 3
         self.hedgesNStrikesAway = 8
 
-        self.stopLosses = {
-            datetime.time(hour=9, minute=15): 40,
-            datetime.time(hour=9, minute=30): 40,
-            datetime.time(hour=9, minute=45): 40,
-            datetime.time(hour=10, minute=0): 40,
-            datetime.time(hour=10, minute=15): 40,
-            datetime.time(hour=10, minute=30): 45,
-            datetime.time(hour=10, minute=45): 50,
-            datetime.time(hour=11, minute=0): 50,
-            datetime.time(hour=11, minute=15): 50,
-            datetime.time(hour=11, minute=30): 50,
-            datetime.time(hour=11, minute=45): 50,
-            datetime.time(hour=12, minute=0): 50,
-            datetime.time(hour=12, minute=15): 50,
-            datetime.time(hour=12, minute=30): 50,
-            datetime.time(hour=12, minute=45): 50,
-            datetime.time(hour=13, minute=0): 60,
-            datetime.time(hour=13, minute=15): 70,
-            datetime.time(hour=13, minute=30): 80,
-            datetime.time(hour=13, minute=45): 90,
-            datetime.time(hour=14, minute=0): 100,
-            datetime.time(hour=14, minute=15): 100,
-            datetime.time(hour=14, minute=30): 100,
-            datetime.time(hour=14, minute=45): 100
-        }
+        self._expiryCache: Dict[datetime.date, datetime.date] = {}
+        self._symbolCache: Dict[tuple, str] = {}
+
+        self.stopLosses = self._STOP_LOSSES
 
         self.resampledBars = resampled.ResampledBars(
-            self.getFeed(), pyalgotrade.bar.Frequency.MINUTE, self.onResampledBars)
+            self._feed, pyalgotrade.bar.Frequency.MINUTE, self.onResampledBars)
 
         self.__reset__()
 
@@ -110,9 +145,11 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
         self.pendingSLToCost = set()
         self.pendingCancelExit = set()
         self.pendingExit = set()
-        self.lastSentTime = self.getFeed().getCurrentDateTime().time()
+        self.lastSentTime = self._feed.getCurrentDateTime().time()
+        self._nextInfoAt = None
 
         self.positions: Set[StraddlePosition] = set()
+        self._legToStraddle: Dict[int, StraddlePosition] = {}
 
     def onBars(self, bars: Bars):
         if self.isBacktest():
@@ -124,39 +161,46 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
 
     def strategyLogic(self, bars: Bars = None):
         try:
-            if self.marketStartTime < self.getFeed().getCurrentDateTime().time() < self.marketEndTime:
-                if not self.lastSentTime:
-                    self.lastSentTime = datetime.datetime.now().time()
-
-                lastSentTime = datetime.datetime.combine(
-                    self.getFeed().getCurrentDateTime().date(), self.lastSentTime)
-                lastSentRoundedTime = getRoundedDateTime(
-                    lastSentTime, datetime.timedelta(minutes=15))
-                timeToCheck = (
-                        lastSentRoundedTime + datetime.timedelta(minutes=15)).time()
-
-                if self.getFeed().getCurrentDateTime().time() >= timeToCheck:
-                    self.lastSentTime = self.getFeed().getCurrentDateTime().time()
+            currentDateTime = self._feed.getCurrentDateTime()
+            currentTime = currentDateTime.time()
+            marketEndTime = self.marketEndTime
+
+            if self.marketStartTime < currentTime < marketEndTime:
+                if self._nextInfoAt is None or self._nextInfoAt.date() != currentDateTime.date():
+                    if not self.lastSentTime:
+                        self.lastSentTime = datetime.datetime.now().time()
+
+                    lastSentTime = datetime.datetime.combine(
+                        currentDateTime.date(), self.lastSentTime, tzinfo=currentDateTime.tzinfo)
+                    # Keep the trigger on the current date; a time past 23:45 wraps to 00:00 and fires right away
+                    timeToCheck = (getRoundedDateTime(lastSentTime, INFO_INTERVAL) + INFO_INTERVAL).time()
+                    self._nextInfoAt = datetime.datetime.combine(
+                        currentDateTime.date(), timeToCheck, tzinfo=currentDateTime.tzinfo)
+
+                if currentDateTime >= self._nextInfoAt:
+                    self.lastSentTime = currentTime
+                    self._nextInfoAt = getRoundedDateTime(
+                        currentDateTime, INFO_INTERVAL) + INFO_INTERVAL
                     self.sendInfo()
 
             if self.state in [State.PLACING_ORDERS, State.SQUARING_OFF]:
                 self.handlePlacingOrders()
 
-            if self.getFeed().getCurrentDateTime().time() >= self.marketEndTime:
+            if currentTime >= marketEndTime:
                 if (len(self.getActivePositions()) + len(self.getClosedPositions())) > 0:
                     self.log(
-                        f"🔔 Overall PnL\n\nOverall PnL for {self.getFeed().getCurrentDateTime().date()} is {self.getOverallPnL()}")
+                        f"🔔 Overall PnL\n\nOverall PnL for {currentDateTime.date()} is {self.getOverallPnL()}")
                     self.sendPnLImage()
                     self.__reset__()
-            elif self.getFeed().getCurrentDateTime().time() >= self.exitTime:
+            elif currentTime >= self.exitTime:
                 if self.state == State.ENTERED:
                     self.log(
-                        f"🔔 Exit Time Reached\n\nCurrent time {self.getFeed().getCurrentDateTime().time()} is >= Exit time {self.exitTime}. "
+                        f"🔔 Exit Time Reached\n\nCurrent time {currentTime} is >= Exit time {self.exitTime}. "
                         "Closing all positions!")
                     self.closeAllPositions()
         except Exception as e:
             self.logger.error(e)
-            self.logger.exception(traceback.format_exc())
+            self.logger.exception('strategyLogic failed')
         finally:
             if bars is None:
                 return
@@ -174,7 +218,7 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
                 self.positions.add(self.enterPositions())
         except Exception as e:
             self.logger.error(e)
-            self.logger.exception(traceback.format_exc())
+            self.logger.exception('onResampledBars failed')
 
     def enterPositions(self):
         atmStrike = self.getATMStrike(self.getLastPrice(self.underlying), self.strikeDifference)
@@ -182,17 +226,17 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
         if atmStrike is None:
             return None
 
-        currentDate = self.getFeed().getCurrentDateTime().date()
-        currentExpiry = utils.getNearestWeeklyExpiryDate(currentDate, self.underlyingIndex)
+        currentDate = self._feed.getCurrentDateTime().date()
+        currentExpiry = self._expiryCache.get(currentDate)
+        if currentExpiry is None:
+            currentExpiry = utils.getNearestWeeklyExpiryDate(currentDate, self.underlyingIndex)
+            self._expiryCache[currentDate] = currentExpiry
 
-        ceHedgeSymbol = self.getBroker().getOptionSymbol(self.underlying, currentExpiry,
-                                                         atmStrike + (self.hedgesNStrikesAway * self.strikeDifference),
-                                                         'c')
-        ceShortSymbol = self.getBroker().getOptionSymbol(self.underlying, currentExpiry, atmStrike, 'c')
-        peHedgeSymbol = self.getBroker().getOptionSymbol(self.underlying, currentExpiry,
-                                                         atmStrike - (self.hedgesNStrikesAway * self.strikeDifference),
-                                                         'p')
-        peShortSymbol = self.getBroker().getOptionSymbol(self.underlying, currentExpiry, atmStrike, 'p')
+        hedgeOffset = self.hedgesNStrikesAway * self.strikeDifference
+        ceHedgeSymbol = self._getCachedOptionSymbol(currentExpiry, atmStrike + hedgeOffset, 'c')
+        ceShortSymbol = self._getCachedOptionSymbol(currentExpiry, atmStrike, 'c')
+        peHedgeSymbol = self._getCachedOptionSymbol(currentExpiry, atmStrike - hedgeOffset, 'p')
+        peShortSymbol = self._getCachedOptionSymbol(currentExpiry, atmStrike, 'p')
 
         self.state = State.PLACING_ORDERS
         ceHedgePosition = self.enterWithMarketProtection(ceHedgeSymbol, Order.Action.BUY)
@@ -204,39 +248,45 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
         self.pendingEntry.add(peHedgePosition)
         self.pendingEntry.add(ceShortPosition)
         self.pendingEntry.add(peShortPosition)
-        return StraddlePosition(ceHedgePosition, peHedgePosition, ceShortPosition, peShortPosition, atmStrike)
-
-    def getRoundedOffPriceByTickSize(self, price):
-        return price - (price % self.tickSize)
+        straddlePosition = StraddlePosition(ceHedgePosition, peHedgePosition, ceShortPosition, peShortPosition,
+                                            atmStrike)
+        for shortPosition in (ceShortPosition, peShortPosition):
+            if shortPosition is not None:
+                self._legToStraddle[id(shortPosition)] = straddlePosition
+        return straddlePosition
+
+    def _getCachedOptionSymbol(self, expiry, strike, optionType):
+        key = (expiry, strike, optionType)
+        symbol = self._symbolCache.get(key)
+        if symbol is None:
+            symbol = self.getBroker().getOptionSymbol(self.underlying, expiry, strike, optionType)
+            self._symbolCache[key] = symbol
+        return symbol
 
     def exitWithMarketProtection(self, position: Position):
-        lastBar = self.getFeed().getLastBar(position.getInstrument())
+        lastBar = self._feed.getLastBar(position.getInstrument())
         if lastBar is None:
             self.logger.info(f'LTP of <{position.getInstrument()}> is None while exiting with market position.')
             return
 
         if position.getEntryOrder().isBuy():
-            limitPrice = self.getRoundedOffPriceByTickSize(
-                lastBar.getClose() * (1 - (self.marketProtectionPercentage / 100.0)))
+            limitPrice = roundToTick(lastBar.getClose() * self._mpDown)
         else:
-            limitPrice = self.getRoundedOffPriceByTickSize(
-                lastBar.getClose() * (1 + (self.marketProtectionPercentage / 100.0)))
+            limitPrice = roundToTick(lastBar.getClose() * self._mpUp)
 
         position.exitLimit(limitPrice)
 
     def enterWithMarketProtection(self, symbol, action: Order.Action):
-        lastBar = self.getFeed().getLastBar(symbol)
+        lastBar = self._feed.getLastBar(symbol)
         if lastBar is None:
             self.logger.info(f'LTP of <{symbol}> is None while entering with market position.')
             return
 
         if action == Order.Action.BUY:
-            limitPrice = self.getRoundedOffPriceByTickSize(
-                lastBar.getClose() * (1 + (self.marketProtectionPercentage / 100.0)))
+            limitPrice = roundToTick(lastBar.getClose() * self._mpUp)
             return self.enterLongLimit(symbol, limitPrice, self.quantity)
         else:
-            limitPrice = self.getRoundedOffPriceByTickSize(
-                lastBar.getClose() * (1 - (self.marketProtectionPercentage / 100.0)))
+            limitPrice = roundToTick(lastBar.getClose() * self._mpDown)
             return self.enterShortLimit(symbol, limitPrice, self.quantity)
 
     def closeAllPositions(self):
@@ -251,9 +301,7 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
                 self.exitWithMarketProtection(position)
 
     def getStraddlePosition(self, position: Position):
-        straddlePositions = [straddlePosition for straddlePosition in self.positions if
-                             position in [straddlePosition.ceShort, straddlePosition.peShort]]
-        return straddlePositions[0] if len(straddlePositions) else None
+        return self._legToStraddle.get(id(position))
 
     def onEnterOk(self, position: Position):
         super().onEnterOk(position)
@@ -264,15 +312,11 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
         if straddlePosition is None:
             return
 
-        stopLossesList = [value for time, value in self.stopLosses.items() if time < self.getCurrentDateTime().time()]
-        stopLossPercentage = stopLossesList[-1] if stopLossesList else 20
+        idx = bisect.bisect_left(self._slTimes, self.getCurrentDateTime().time())
+        stopLossPercentage = self._slValues[idx - 1] if idx else 20
 
         entryPrice = position.getEntryOrder().getExecutionInfo().getPrice()
-        stopLoss = entryPrice * (1 + (stopLossPercentage / 100.0))
-        stopLoss = stopLoss - (stopLoss % 0.05)
-        stopLossBuffer = stopLoss * \
-                         ((100 + self.stopLimitBufferPercentage) / 100.0)
-        stopLossBuffer = stopLossBuffer - (stopLossBuffer % 0.05)
+        stopLoss, stopLossBuffer = computeStopLossAndBuffer(entryPrice, stopLossPercentage, self._slBufMul)
         position.exitStopLimit(stopLoss, stopLossBuffer)
 
     def onEnterCanceled(self, position: Position):
@@ -285,17 +329,20 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
 
         if position in self.pendingSLToCost:
             entryPrice = position.getEntryOrder().getExecutionInfo().getPrice()
-            entryPrice = entryPrice - (entryPrice % 0.05)
-            stopLossBuffer = entryPrice * ((100 + self.stopLimitBufferPercentage) / 100.0)
-            stopLossBuffer = stopLossBuffer - (stopLossBuffer % 0.05)
+            entryPrice = roundToTick(entryPrice)
+            stopLossBuffer = roundToTick(entryPrice * self._slBufMul)
 
-            self.state = State.PLACING_ORDERS if self.state != State.SQUARING_OFF else self.state
+            self._toPlacing()
             position.exitStopLimit(entryPrice, stopLossBuffer)
             self.pendingSLToCost.discard(position)
         elif position in self.pendingExit:
-            self.state = State.PLACING_ORDERS if self.state != State.SQUARING_OFF else self.state
+            self._toPlacing()
             self.exitWithMarketProtection(position)
 
+    def _toPlacing(self):
+        if self.state is not State.SQUARING_OFF:
+            self.state = State.PLACING_ORDERS
+
     def onExitOk(self, position: Position):
         super().onExitOk(position)
         self.pendingExit.discard(position)
@@ -319,15 +366,15 @@ class StraddleStrategy(BaseOptionsGreeksStrategy):
             otherPosition.cancelExit()
 
     def handlePlacingOrders(self):
-        if len(self.pendingEntry) or len(self.pendingSLToCost) or len(self.pendingCancelExit) or len(self.pendingExit):
+        if self.pendingEntry or self.pendingSLToCost or self.pendingCancelExit or self.pendingExit:
             return
 
         if not self.isPendingOrdersCompleted():
             return
 
-        if (self.state == State.SQUARING_OFF) and (self.getFeed().getCurrentDateTime().time() >= self.exitTime):
+        if (self.state == State.SQUARING_OFF) and (self._feed.getCurrentDateTime().time() >= self.exitTime):
             self.state = State.EXITED
-        elif len(list(self.getActivePositions())) == 0:
+        elif not self.getActivePositions():
             self.state = State.LIVE
         else:
             self.state = State.ENTERED